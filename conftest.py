@@ -0,0 +1 @@
+# Présence à la racine : pytest ajoute ce dossier au sys.path (import de es_pii_extract_update dans tests/)
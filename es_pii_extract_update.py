@@ -4,7 +4,7 @@
 es_pii_extract_update.py
 ------------------------
 Extraction modulaire (ex: NAS) depuis un index Elasticsearch + mise à jour des documents :
-- Scroll API pour parcourir l’index
+- Point-in-time + search_after (ou Scroll API) pour parcourir l’index, en slices parallèles
 - Détecteurs extensibles (regex + normalisation)
 - Sortie CSV (detector, value, path, _id)
 - Mises à jour BULK optionnelles (ajout dans des tableaux sans doublon)
@@ -34,14 +34,46 @@ from __future__ import annotations
 
 import argparse
 import csv
+import io
+import itertools
 import json
 import os
+import queue
 import re
 import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Callable, Dict, Iterable, List, Optional, Tuple, Any
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union, Any
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:  # google-re2 (optionnel) : regex en temps linéaire (DFA), voir --regex-engine re2
+    import re2  # type: ignore
+except ImportError:
+    re2 = None
+
+try:  # orjson (optionnel) : encode/décode JSON 2-5x plus vite, directement en bytes
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+
+# ---------- JSON ----------
+
+def encode_json(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def decode_json(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 
 # ---------- Normalisation ----------
@@ -49,31 +81,68 @@ import requests
 UNICODE_DASHES = "\u2010\u2011\u2012\u2013\u2014"
 NBSP_SET = {"\u00A0", "\u2007", "\u202F", "\u2009", "\u200B"}  # NBSP, figure, narrow, thin, zero-width
 
+# Compilés une seule fois (appelés pour chaque document)
+_SEP_REPLACE = tuple((c, " ") for c in sorted(NBSP_SET)) + tuple((c, "-") for c in UNICODE_DASHES)
+# seulement les blancs à réécrire (une espace isolée est déjà normale)
+_WS_RE = re.compile(r"[ \t\r\f\v]{2,}|[\t\r\f\v]")
+_WS_CTRL = "\t\r\f\v"
+
 
 def normalize_separators(s: str) -> str:
     """Normalise les séparateurs courants (espaces/tirets unicode) dans un texte."""
     if not s:
         return s
-    for ch in NBSP_SET:
-        s = s.replace(ch, " ")
-    dash_re = re.compile("[" + re.escape(UNICODE_DASHES) + "]")
-    s = dash_re.sub("-", s)
-    s = re.sub(r"[ \t\r\f\v]+", " ", s)
-    return s
+    if not s.isascii():
+        # str.replace (C, rapide) uniquement pour les séparateurs présents
+        for ch, repl in _SEP_REPLACE:
+            if ch in s:
+                s = s.replace(ch, repl)
+    if "  " not in s and not any(c in s for c in _WS_CTRL):
+        # pas de blancs à réduire (cas courant) : on évite la regex
+        return s
+    return _WS_RE.sub(" ", s)
 
 
-def unicode_digits_to_ascii(s: str) -> str:
-    """Convertit des chiffres Unicode (category Nd) en ASCII 0-9, supprime le reste."""
-    out = []
-    for ch in s:
+class _DigitTable(dict):
+    """Table `str.translate` : chiffre Unicode -> ASCII, autre -> supprimé (remplie à la demande)."""
+
+    def __missing__(self, cp: int) -> Optional[str]:
+        ch = chr(cp)
+        val: Optional[str] = None
         if ch.isdigit():
             try:
                 v = int(ch)
             except Exception:
                 v = None
             if v is not None and 0 <= v <= 9:
-                out.append(str(v))
-    return "".join(out)
+                val = str(v)
+        self[cp] = val
+        return val
+
+
+_DIGIT_TRANS = _DigitTable((i, None if not chr(i).isdigit() else chr(i)) for i in range(128))
+
+
+def unicode_digits_to_ascii(s: str) -> str:
+    """Convertit des chiffres Unicode (category Nd) en ASCII 0-9, supprime le reste."""
+    return s.translate(_DIGIT_TRANS)
+
+
+def normalize_nas(s: str) -> Optional[str]:
+    """9 chiffres (unicode acceptés) -> ###-###-###, sinon None."""
+    digits = unicode_digits_to_ascii(s)
+    if len(digits) != 9:
+        return None
+    return f"{digits[0:3]}-{digits[3:6]}-{digits[6:9]}"
+
+
+# Normaliseurs référençables par nom depuis le YAML (clé `normalize`)
+NORMALIZERS: Dict[str, Callable[[str], Optional[str]]] = {
+    "nas": normalize_nas,
+    "digits": unicode_digits_to_ascii,
+    "lower": str.lower,
+    "upper": str.upper,
+}
 
 
 # ---------- Détecteurs ----------
@@ -81,7 +150,7 @@ def unicode_digits_to_ascii(s: str) -> str:
 @dataclass
 class Detector:
     name: str
-    pattern: re.Pattern
+    pattern: re.Pattern  # ou motif re2 compilé (même API finditer)
     normalizer: Optional[Callable[[str], Optional[str]]] = None
     desc: str = ""
 
@@ -95,35 +164,92 @@ class Detector:
 
 def make_nas_detector() -> Detector:
     """
-    NAS canadien : capture 9 chiffres avec séparateurs optionnels (espace/tiret/underscore/point/slash),
-    accepte chiffres unicode puis normalise en ###-###-###.
+    NAS canadien : capture exactement 9 chiffres avec séparateurs optionnels (espace/tiret/underscore/point/slash,
+    au plus 3 entre deux chiffres), accepte chiffres unicode puis normalise en ###-###-###.
+    Les lookarounds empêchent de matcher à l'intérieur d'une suite de chiffres plus longue ; séparateurs et
+    chiffres étant disjoints, le motif ne peut pas backtracker de façon ambiguë.
     """
-    pat = re.compile(r"(\d[\d\-\s_./]{7,24}\d)|(\d{9})")
-
-    def _norm(s: str) -> Optional[str]:
-        digits = unicode_digits_to_ascii(s)
-        if len(digits) != 9:
-            return None
-        return f"{digits[0:3]}-{digits[3:6]}-{digits[6:9]}"
-
+    pat = re.compile(r"(?<!\d)\d(?:[-\s_./]{0,3}\d){8}(?!\d)")
     return Detector(
         name="NAS",
         pattern=pat,
-        normalizer=_norm,
+        normalizer=normalize_nas,
         desc="Canadian SIN ###-###-### (separators and unicode digits accepted).",
     )
 
 
-def load_detectors_from_yaml(path: str) -> List[Detector]:
+class Re2SetDetector:
+    """
+    Pré-filtre RE2 : un `re2.Set` teste en un seul passage linéaire quels détecteurs RE2
+    matchent quelque part dans le texte ; seuls ceux-là (et les détecteurs `re`) sont exécutés.
+    """
+
+    def __init__(self, detectors: List[Detector]):
+        self.detectors = detectors
+        opts = re2.Options()
+        opts.log_errors = False
+        self.set = re2.Set.SearchSet(opts)
+        self.set_index: Dict[int, int] = {}  # index détecteur -> index dans le Set
+        for i, det in enumerate(detectors):
+            if not isinstance(det.pattern, re.Pattern):
+                self.set_index[i] = self.set.Add(det.pattern.pattern)
+        self.set.Compile()
+
+    def scan(self, text: str) -> List[Tuple[str, str]]:
+        matched = set(self.set.Match(text) or ())
+        out: List[Tuple[str, str]] = []
+        for i, det in enumerate(self.detectors):
+            j = self.set_index.get(i)
+            if j is not None and j not in matched:
+                continue
+            for val in det.find(text):
+                out.append((det.name, val))
+        return out
+
+
+def build_re2_set_detector(detectors: List[Detector]) -> Optional[Re2SetDetector]:
+    """Construit le pré-filtre RE2, ou None si aucun détecteur n'est compilé avec RE2."""
+    if re2 is None or all(isinstance(d.pattern, re.Pattern) for d in detectors):
+        return None
+    try:
+        return Re2SetDetector(detectors)
+    except re2.error as e:
+        print(f"Pré-filtre RE2 impossible ({e}); mode par détecteur.", file=sys.stderr)
+        return None
+
+
+_SCOPED_FLAGS = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"))
+
+
+def compile_detector_regex(regex: str, flags: int = 0, engine: str = "re"):
+    """
+    Compile un motif de détecteur. Avec engine="re2" (et google-re2 installé), utilise RE2
+    si le motif est compatible (pas de backreference/lookaround, flags i/m/s) ; sinon `re`.
+    Attention : avec RE2, \\d, \\w et \\b ne reconnaissent que l'ASCII.
+    """
+    if engine == "re2" and re2 is not None and not flags & ~(re.IGNORECASE | re.MULTILINE | re.DOTALL):
+        letters = "".join(letter for flag, letter in _SCOPED_FLAGS if flags & flag)
+        opts = re2.Options()
+        opts.log_errors = False
+        try:
+            return re2.compile(f"(?{letters}){regex}" if letters else regex, opts)
+        except re2.error:
+            pass
+    return re.compile(regex, flags)
+
+
+def load_detectors_from_yaml(path: str, engine: str = "re") -> List[Detector]:
     """
     Charge des détecteurs depuis YAML (facultatif).
     Format YAML (exemple):
       - name: NAS
-        regex: '(\\d[\\d\\-\\s_./]{7,24}\\d)|(\\d{9})'
+        regex: '(?<!\\d)\\d(?:[-\\s_./]{0,3}\\d){8}(?!\\d)'
         normalize: nas
       - name: EMAIL
         regex: '(?i)[A-Z0-9._%+-]+@[A-Z0-9.-]+\\.[A-Z]{2,}'
         flags: IGNORECASE
+        normalize: lower
+    `normalize` référence une entrée de NORMALIZERS (nas, digits, lower, upper).
     """
     try:
         import yaml  # type: ignore
@@ -152,14 +278,13 @@ def load_detectors_from_yaml(path: str) -> List[Detector]:
             elif isinstance(fl, list):
                 for f in fl:
                     flags |= flags_map.get(str(f).upper(), 0)
-        pat = re.compile(regex, flags)
+        pat = compile_detector_regex(regex, flags, engine)
 
         normalizer = None
-        if item.get("normalize") == "nas":
-            def _norm_local(s: str) -> Optional[str]:
-                digits = unicode_digits_to_ascii(s)
-                return f"{digits[0:3]}-{digits[3:6]}-{digits[6:9]}" if len(digits) == 9 else None
-            normalizer = _norm_local
+        if item.get("normalize"):
+            normalizer = NORMALIZERS.get(item["normalize"])
+            if normalizer is None:
+                print(f"Normaliseur inconnu '{item['normalize']}' pour {name} (ignoré)", file=sys.stderr)
 
         detectors.append(Detector(name=name, pattern=pat, normalizer=normalizer, desc=item.get("desc", "")))
     return detectors
@@ -178,11 +303,24 @@ class ESClient:
         ca_cert: Optional[str] = None,
         timeout: int = 60,
         verify_tls: bool = True,
+        gzip_requests: bool = False,
     ):
         self.base_url = base_url.rstrip("/")
         self.session = requests.Session()
         self.timeout = timeout
         self.verify = verify_tls if not ca_cert else ca_cert
+        self.gzip_requests = gzip_requests
+        # pool de connexions keep-alive (threads lecture/envoi).
+        # Retries : échecs de connexion, et 502/503/504 pour les méthodes idempotentes seulement
+        # (allowed_methods par défaut de urllib3). Les POST (_search, scroll, _pit, _bulk) ne sont
+        # pas rejoués sur 5xx : un corps en flux (générateur) déjà consommé ne peut pas être renvoyé.
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=32,
+            max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         # auth
         if api_key:
             self.session.headers["Authorization"] = f"ApiKey {api_key}"
@@ -194,34 +332,127 @@ class ESClient:
 
     def search_scroll(self, index: str, query: Dict[str, Any], size: int = 500, scroll: str = "2m"):
         """Générateur sur tous les hits via Scroll API."""
+        for hits in self.search_scroll_pages(index, query, size=size, scroll=scroll):
+            yield from hits
+
+    def search_scroll_pages(self, index: str, query: Dict[str, Any], size: int = 500, scroll: str = "2m"):
+        """Générateur sur les pages de hits (une liste par réponse) via Scroll API."""
         url = f"{self.base_url}/{index}/_search?scroll={scroll}"
         body = {"size": size, **query}
-        r = self.session.post(url, data=json.dumps(body), timeout=self.timeout, verify=self.verify)
+        r = self.session.post(url, data=encode_json(body), timeout=self.timeout, verify=self.verify)
         r.raise_for_status()
-        data = r.json()
+        data = decode_json(r.content)
         scroll_id = data.get("_scroll_id")
         hits = data.get("hits", {}).get("hits", [])
-        for h in hits:
-            yield h
+        if hits:
+            yield hits
         while True:
             if not hits or not scroll_id:
                 break
             r = self.session.post(
                 f"{self.base_url}/_search/scroll",
-                data=json.dumps({"scroll": scroll, "scroll_id": scroll_id}),
+                data=encode_json({"scroll": scroll, "scroll_id": scroll_id}),
                 timeout=self.timeout,
                 verify=self.verify,
             )
             r.raise_for_status()
-            data = r.json()
+            data = decode_json(r.content)
             scroll_id = data.get("_scroll_id")
             hits = data.get("hits", {}).get("hits", [])
-            for h in hits:
-                yield h
+            if hits:
+                yield hits
+
+    def put_script(self, script_id: str, source: str, lang: str = "painless"):
+        """Enregistre (ou remplace) un script stocké."""
+        r = self.session.put(
+            f"{self.base_url}/_scripts/{script_id}",
+            data=encode_json({"script": {"lang": lang, "source": source}}),
+            timeout=self.timeout,
+            verify=self.verify,
+        )
+        r.raise_for_status()
+
+    def open_pit(self, index: str, keep_alive: str = "2m") -> str:
+        """Ouvre un point-in-time sur l'index et retourne son id."""
+        url = f"{self.base_url}/{index}/_pit?keep_alive={keep_alive}"
+        r = self.session.post(url, timeout=self.timeout, verify=self.verify)
+        r.raise_for_status()
+        return decode_json(r.content)["id"]
+
+    def close_pit(self, pit_id: str):
+        r = self.session.delete(
+            f"{self.base_url}/_pit", data=encode_json({"id": pit_id}), timeout=self.timeout, verify=self.verify
+        )
+        r.raise_for_status()
+
+    def search_after_pages(
+        self,
+        pit_id: str,
+        query: Dict[str, Any],
+        size: int = 500,
+        keep_alive: str = "2m",
+        slice_id: Optional[int] = None,
+        slices: Optional[int] = None,
+        pit_holder: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Générateur sur les pages de hits via PIT + search_after (sans contexte scroll).
+        Avec `slices` > 1, ne parcourt que la slice `slice_id` (curseur indépendant par slice).
+        ES peut renvoyer un nouvel id de PIT à chaque réponse : s'il est fourni, `pit_holder["id"]`
+        reçoit le dernier id connu (c'est celui qu'il faut fermer).
+        """
+        url = f"{self.base_url}/_search"
+        body: Dict[str, Any] = {"size": size, **query}
+        body.setdefault("sort", [{"_shard_doc": "asc"}])  # _shard_doc : ES >= 7.12
+        if slices and slices > 1:
+            body["slice"] = {"id": slice_id, "max": slices}
+        while True:
+            body["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+            r = self.session.post(url, data=encode_json(body), timeout=self.timeout, verify=self.verify)
+            r.raise_for_status()
+            data = decode_json(r.content)
+            pit_id = data.get("pit_id") or pit_id
+            if pit_holder is not None:
+                pit_holder["id"] = pit_id
+            hits = data.get("hits", {}).get("hits", [])
+            if not hits:
+                break
+            # lu avant le yield : la page appartient ensuite au consommateur (autre thread, hit.clear())
+            last_sort = hits[-1]["sort"]
+            yield hits
+            # pas d'arrêt sur page courte : la requête peut imposer son propre "size"
+            body["search_after"] = last_sort
+
+    def msearch(self, index: str, bodies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Plusieurs recherches en une seule requête HTTP (_msearch) : un aller-retour au lieu de N.
+        Retourne la liste des réponses, dans l'ordre de `bodies`.
+        """
+        if not bodies:
+            return []
+        url = f"{self.base_url}/{index}/_msearch"
+        headers = {"Content-Type": "application/x-ndjson"}
+        lines: List[bytes] = []
+        for body in bodies:
+            lines.append(b"{}")
+            lines.append(encode_json(body))
+        r = self.session.post(url, data=ndjson_chunks(lines), headers=headers, timeout=self.timeout, verify=self.verify)
+        r.raise_for_status()
+        return decode_json(r.content).get("responses", [])
 
-    def bulk(self, actions_ndjson: str):
+    def bulk(self, actions_ndjson: Union[str, bytes, Iterable[bytes]]):
+        """POST _bulk ; accepte un corps complet ou un itérable de bytes (envoi chunked, sans tampon)."""
         url = f"{self.base_url}/_bulk"
         headers = {"Content-Type": "application/x-ndjson"}
+        if not isinstance(actions_ndjson, (str, bytes)):
+            actions_ndjson = iter(actions_ndjson)  # requests encoderait une liste en formulaire
+        if self.gzip_requests:
+            if isinstance(actions_ndjson, str):
+                actions_ndjson = actions_ndjson.encode("utf-8")
+            if isinstance(actions_ndjson, bytes):
+                actions_ndjson = [actions_ndjson]
+            actions_ndjson = gzip_chunks(actions_ndjson)
+            headers["Content-Encoding"] = "gzip"
         r = self.session.post(url, data=actions_ndjson, headers=headers, timeout=self.timeout, verify=self.verify)
         # Montrer la réponse brute si status >= 400
         if r.status_code >= 400:
@@ -232,7 +463,7 @@ class ESClient:
             except Exception:
                 pass
             r.raise_for_status()
-        data = r.json()
+        data = decode_json(r.content)
         if data.get("errors"):
             # Afficher 1-5 erreurs d’items
             items = data.get("items", [])
@@ -243,45 +474,190 @@ class ESClient:
         return data
 
 
+# ---------- Pipeline (lecture / envoi en arrière-plan) ----------
+
+PIPELINE_DEPTH = 4  # pages / bulks en attente max entre les étapes
+
+
+def prefetch(items: Iterable[Any], executor: ThreadPoolExecutor, depth: int = PIPELINE_DEPTH) -> Iterator[Any]:
+    """
+    Consomme `items` dans un thread d'arrière-plan et les rend via une file bornée :
+    la page suivante du scroll est téléchargée pendant que la page courante est traitée.
+    Les exceptions du producteur sont relancées côté consommateur.
+    """
+    return prefetch_many([items], executor, depth)
+
+
+def prefetch_many(
+    sources: List[Iterable[Any]], executor: ThreadPoolExecutor, depth: int = PIPELINE_DEPTH
+) -> Iterator[Any]:
+    """Comme `prefetch`, avec un thread par source (ex: une par slice) fusionnées dans la même file."""
+    q: "queue.Queue[Tuple[bool, Any]]" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _put(item: Tuple[bool, Any]) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(items: Iterable[Any]):
+        try:
+            for x in items:
+                if not _put((True, x)):
+                    return
+        except BaseException as e:
+            _put((False, e))
+            return
+        _put((False, None))
+
+    for src in sources:
+        executor.submit(_run, src)
+    remaining = len(sources)
+    try:
+        while remaining:
+            ok, x = q.get()
+            if ok:
+                yield x
+            elif x is not None:
+                raise x
+            else:
+                remaining -= 1
+    finally:
+        stop.set()
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compresse un flux de bytes en gzip à la volée (corps de requête chunked)."""
+    co = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for c in chunks:
+        out = co.compress(c)
+        if out:
+            yield out
+    yield co.flush()
+
+
+def ndjson_chunks(lines: Iterable[bytes]) -> Iterator[bytes]:
+    for b in lines:
+        yield b
+        yield b"\n"
+
+
+class BulkSender:
+    """Envoie les bulks dans un thread d'arrière-plan (file bornée, ordre conservé)."""
+
+    def __init__(self, es: ESClient, executor: ThreadPoolExecutor, depth: int = PIPELINE_DEPTH):
+        self.es = es
+        self.queue: "queue.Queue[Optional[List[bytes]]]" = queue.Queue(maxsize=depth)
+        self.error: Optional[BaseException] = None
+        self.future = executor.submit(self._run)
+
+    def _run(self):
+        while True:
+            lines = self.queue.get()
+            if lines is None:
+                return
+            if self.error is not None:
+                continue  # vider la file sans envoyer après une erreur
+            try:
+                self.es.bulk(ndjson_chunks(lines))
+            except BaseException as e:
+                self.error = e
+
+    def submit(self, lines: List[bytes]):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(lines)
+
+    def close(self):
+        """Attend la fin des envois en cours ; relance l'erreur éventuelle."""
+        self.queue.put(None)
+        self.future.result()
+        if self.error is not None:
+            raise self.error
+
+
 # ---------- Extraction + MAJ ----------
 
-def get_text_from_source(src: Dict[str, Any], content_field: str, alt_field: Optional[str]) -> str:
+FieldPath = Union[str, Tuple[str, ...]]
+_MISSING = object()
+
+
+def field_keys(field: FieldPath) -> Tuple[str, ...]:
+    """ "path.virtual" -> ("path", "virtual") ; à calculer une fois par exécution, pas par document."""
+    return tuple(field.split(".")) if isinstance(field, str) else field
+
+
+def _get_path(src: Any, keys: Tuple[str, ...]) -> Any:
+    cur = src
+    try:
+        for k in keys:
+            cur = cur[k]
+    except (KeyError, TypeError, IndexError):
+        return _MISSING
+    return cur
+
+
+def get_text_from_source(src: Dict[str, Any], content_field: str, alt_field: Optional[FieldPath]) -> str:
     if content_field in src and src[content_field] is not None:
         return str(src[content_field])
     if alt_field:
-        cur: Any = src
-        for part in alt_field.split("."):
-            if isinstance(cur, dict) and part in cur:
-                cur = cur[part]
-            else:
-                cur = None
-                break
-        if cur:
+        cur = _get_path(src, field_keys(alt_field))
+        if cur is not _MISSING and cur:
             return str(cur)
     return ""
 
 
-def get_path_virtual(src: Dict[str, Any], path_field: str = "path.virtual") -> str:
-    cur: Any = src
-    for p in path_field.split("."):
-        if isinstance(cur, dict) and p in cur:
-            cur = cur[p]
-        else:
-            return ""
-    return str(cur)
+def get_path_virtual(src: Dict[str, Any], path_field: FieldPath = "path.virtual") -> str:
+    cur = _get_path(src, field_keys(path_field))
+    return "" if cur is _MISSING else str(cur)
 
 
-def extract_from_text(text: str, detectors: List[Detector]) -> List[Tuple[str, str]]:
+def extract_from_text(
+    text: str,
+    detectors: List[Detector],
+    prefilter: Optional[Re2SetDetector] = None,
+) -> List[Tuple[str, str]]:
     out: List[Tuple[str, str]] = []
     if not text:
         return out
     text = normalize_separators(text)
+    if prefilter is not None:
+        return prefilter.scan(text)
     for det in detectors:
         for val in det.find(text):
             out.append((det.name, val))
     return out
 
 
+_CSV_QUOTE_RE = re.compile(r'[,"\r\n]')
+
+
+class FastCsvWriter:
+    """
+    Équivalent de csv.writer (dialecte excel) écrivant des bytes dans un fichier binaire bufferisé.
+    Les lignes sans caractère à échapper sont formatées directement ; les autres passent par csv.
+    """
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self._buf = io.StringIO()
+        self._csv = csv.writer(self._buf)
+
+    def writerow(self, row: Sequence[str]):
+        line = ",".join(row)
+        if line.count(",") == len(row) - 1 and not _CSV_QUOTE_RE.search(line):
+            self.f.write((line + "\r\n").encode("utf-8"))
+            return
+        self._csv.writerow(row)
+        self.f.write(self._buf.getvalue().encode("utf-8"))
+        self._buf.seek(0)
+        self._buf.truncate()
+
+
 def parse_field_map(s: Optional[str]) -> Dict[str, str]:
     """
     Convertit "NAS=nas_norm,EMAIL=emails" -> {"NAS":"nas_norm","EMAIL":"emails"}
@@ -310,11 +686,9 @@ def target_field(detector_name: str, fmap: Dict[str, str], prefix: str) -> str:
     return f"{prefix}{field}" if prefix else field
 
 
-def build_update_script_params(field_to_values: Dict[str, List[str]]) -> Tuple[str, Dict[str, Any]]:
-    """
-    Construit le script painless + params pour ajouter des valeurs dans des tableaux sans doublon.
-    """
-    script = """
+# Script painless : ajoute des valeurs dans des tableaux sans doublon
+PII_APPEND_SCRIPT_ID = "pii_append"
+PII_APPEND_SCRIPT = """
       def up = params.upd;
       for (entry in up.entrySet()) {
         def f = entry.getKey();
@@ -325,7 +699,32 @@ def build_update_script_params(field_to_values: Dict[str, List[str]]) -> Tuple[s
         }
       }
     """
-    return script, {"upd": field_to_values}
+
+
+def build_update_script_params(
+    field_to_values: Union[Dict[str, List[str]], str], script_id: Optional[str] = PII_APPEND_SCRIPT_ID
+) -> Dict[str, Any]:
+    """
+    Construit le corps d'update : référence au script stocké `script_id`,
+    ou script painless inline si `script_id` est None.
+    `field_to_values` peut aussi être `_JSON_MARK` pour construire le gabarit (voir json_template).
+    """
+    params = {"upd": field_to_values}
+    if script_id:
+        return {"script": {"id": script_id, "params": params}}
+    return {"script": {"lang": "painless", "source": PII_APPEND_SCRIPT, "params": params}}
+
+
+_JSON_MARK = "\u0000pii-mark\u0000"
+
+
+def json_template(obj: Any) -> Tuple[bytes, bytes]:
+    """
+    Encode `obj` une seule fois et le coupe autour de la valeur `_JSON_MARK` :
+    par document, il ne reste qu'à concaténer préfixe + valeur encodée + suffixe.
+    """
+    prefix, suffix = encode_json(obj).split(encode_json(_JSON_MARK))
+    return prefix, suffix
 
 
 def parse_args() -> argparse.Namespace:
@@ -342,6 +741,13 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--ca-cert", help="Chemin CA (si TLS self-signed)")
     p.add_argument("--no-verify-tls", action="store_true", help="Désactiver la vérification TLS")
     p.add_argument("--batch-size", type=int, default=500, help="Taille de lot pour le scroll")
+    p.add_argument(
+        "--pagination",
+        choices=["pit", "scroll"],
+        default="pit",
+        help="Parcours de l'index: pit (PIT + search_after, ES >= 7.12) ou scroll (ES plus ancien) (défaut: pit)",
+    )
+    p.add_argument("--slices", type=int, default=1, help="Nb de slices lues en parallèle (pagination pit)")
     p.add_argument("--content-field", default="content", help="Champ texte principal (def: content)")
     p.add_argument("--alt-content-field", default="attachment.content", help="Champ texte alternatif")
     p.add_argument("--path-field", default="path.virtual", help="Champ chemin (def: path.virtual)")
@@ -353,7 +759,36 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--field-prefix", default="pii.", help='Préfixe par défaut pour les champs (défaut: "pii.")')
     p.add_argument("--apply-updates", action="store_true", help="Appliquer les mises à jour dans ES")
     p.add_argument("--bulk-size", type=int, default=1000, help="Nb d’updates par bulk")
-    return p.parse_args()
+    p.add_argument(
+        "--max-values-per-field",
+        type=int,
+        default=256,
+        help="Nb max de valeurs uniques par champ et par document dans les updates (0 = illimité; CSV complet)",
+    )
+    p.add_argument(
+        "--bulk-max-bytes",
+        type=int,
+        default=5 * 1024 * 1024,
+        help="Taille max (octets) du corps d'un bulk avant envoi (défaut: 5 MiB)",
+    )
+    p.add_argument("--gzip-bulk", action="store_true", help="Compresser (gzip) le corps des requêtes _bulk")
+    p.add_argument(
+        "--regex-engine",
+        choices=["re", "re2"],
+        default="re",
+        help="Moteur des détecteurs YAML: re (défaut) ou re2 (google-re2, temps linéaire, classes ASCII)",
+    )
+    args = p.parse_args()
+    if args.max_values_per_field < 0:
+        p.error("--max-values-per-field doit être >= 0")
+    if args.slices < 1:
+        p.error("--slices doit être >= 1")
+    if args.slices > 1 and args.pagination != "pit":
+        p.error("--slices nécessite --pagination pit")
+    if args.regex_engine == "re2" and re2 is None:
+        print("google-re2 n'est pas installé (`pip install google-re2`); moteur re utilisé.", file=sys.stderr)
+        args.regex_engine = "re"
+    return args
 
 
 def main():
@@ -367,108 +802,162 @@ def main():
         bearer=args.bearer,
         ca_cert=args.ca_cert,
         verify_tls=not args.no_verify_tls,
+        gzip_requests=args.gzip_bulk,
     )
 
     # Détecteurs
     detectors: List[Detector] = [make_nas_detector()]
     if args.detectors_yaml:
-        detectors.extend(load_detectors_from_yaml(args.detectors_yaml))
+        detectors.extend(load_detectors_from_yaml(args.detectors_yaml, engine=args.regex_engine))
+    prefilter = build_re2_set_detector(detectors) if args.regex_engine == "re2" else None
+
+    # Chemins pointés découpés une seule fois
+    path_keys = field_keys(args.path_field)
+    alt_keys = field_keys(args.alt_content_field) if args.alt_content_field else None
 
     # Mapping détecteur -> champ
     fmap = parse_field_map(args.field_map or "")
 
-    # Construire la requête initiale
+    # Construire la requête initiale ; _source limité aux seuls champs lus (chemins complets)
+    needed_fields = [args.content_field, args.path_field]
+    if args.alt_content_field:
+        needed_fields.append(args.alt_content_field)
     if args.query_json:
         with open(args.query_json, "r", encoding="utf-8") as f:
             query = json.load(f)
         # s'assurer que _source inclut les champs nécessaires
-        src_fields = set(query.get("_source") or [])
-        src_fields.update({args.content_field, args.path_field.split(".")[0]})
-        query["_source"] = list(src_fields)
+        src = query.get("_source")
+        src_fields = [src] if isinstance(src, str) else list(src) if isinstance(src, list) else []
+        src_fields += [f for f in needed_fields if f not in src_fields]
+        query["_source"] = src_fields
     else:
-        query = {"query": {"match_all": {}}, "_source": [args.content_field, args.path_field.split(".")[0]]}
+        query = {"query": {"match_all": {}}, "_source": needed_fields}
 
     # Écriture CSV
     os.makedirs(os.path.dirname(os.path.abspath(args.out)) or ".", exist_ok=True)
-    out_f = open(args.out, "w", newline="", encoding="utf-8")
-    writer = csv.writer(out_f)
+    out_f = open(args.out, "wb", buffering=1 << 20)
+    writer = FastCsvWriter(out_f)
     writer.writerow(["detector", "value", "path", "doc_id"])
 
     seen_csv: set[Tuple[str, str, str]] = set()
+    seen_add = seen_csv.add
+    write_row = writer.writerow
+    dedupe = args.dedupe
+    max_values = args.max_values_per_field
+
+    # Script d'update stocké une fois côté ES (sinon inline dans chaque action)
+    script_id: Optional[str] = None
+    if args.apply_updates:
+        try:
+            es.put_script(PII_APPEND_SCRIPT_ID, PII_APPEND_SCRIPT)
+            script_id = PII_APPEND_SCRIPT_ID
+        except requests.RequestException as e:
+            print(f"Script stocké impossible ({e}); script inline utilisé.", file=sys.stderr)
+
+    # Fragments JSON constants des actions bulk, encodés une fois
+    header_prefix, header_suffix = json_template(
+        {"update": {"_index": args.index, "_id": _JSON_MARK, "retry_on_conflict": 3}}
+    )
+    body_prefix, body_suffix = json_template(build_update_script_params(_JSON_MARK, script_id))
+
+    # Pipeline : lecture scroll + envoi bulk en arrière-plan, extraction dans le thread principal
+    pit_id = es.open_pit(args.index) if args.pagination == "pit" else None
+    pool = ThreadPoolExecutor(max_workers=args.slices + 1, thread_name_prefix="es-pii")
+    sender = BulkSender(es, pool) if args.apply_updates else None
+    # dernier id de PIT renvoyé par ES, partagé entre les slices (fermé en fin de parcours)
+    pit = {"id": pit_id}
+    if pit_id is not None:
+        sources = [
+            es.search_after_pages(
+                pit_id, query, size=args.batch_size, slice_id=i, slices=args.slices, pit_holder=pit
+            )
+            for i in range(args.slices)
+        ]
+        pages = prefetch_many(sources, pool)
+    else:
+        pages = prefetch(es.search_scroll_pages(index=args.index, query=query, size=args.batch_size), pool)
 
-    # Bulk buffer
-    bulk_lines: List[str] = []
+    # Bulk buffer (lignes NDJSON déjà encodées)
+    bulk_lines: List[bytes] = []
+    bulk_bytes = 0
 
     def flush_bulk():
-        nonlocal bulk_lines
-        if not bulk_lines:
+        nonlocal bulk_lines, bulk_bytes
+        if not bulk_lines or sender is None:
             return
-        ndjson = "\n".join(bulk_lines) + "\n"
-        es.bulk(ndjson)
+        sender.submit(bulk_lines)
         bulk_lines = []
+        bulk_bytes = 0
 
     docs_count = 0
     pairs_count = 0
     updates_count = 0
 
     try:
-        for hit in es.search_scroll(index=args.index, query=query, size=args.batch_size):
+        for hit in itertools.chain.from_iterable(pages):
             docs_count += 1
             _id = hit.get("_id", "")
             src = hit.get("_source") or {}
-            text = get_text_from_source(src, args.content_field, args.alt_content_field)
+            hit.clear()  # libérer le hit dès maintenant (la page reste référencée jusqu'à la fin)
+            text = get_text_from_source(src, args.content_field, alt_keys)
             if not text:
                 continue
-            path = get_path_virtual(src, args.path_field)
-            pairs = extract_from_text(text, detectors)
+            path = get_path_virtual(src, path_keys)
+            pairs = extract_from_text(text, detectors, prefilter)
 
             # Écrire CSV
             for det_name, value in pairs:
-                row = (det_name, value, path, _id)
-                if args.dedupe:
+                if dedupe:
                     key = (det_name, value, path)
                     if key in seen_csv:
                         continue
-                    seen_csv.add(key)
-                writer.writerow(row)
+                    seen_add(key)
+                write_row((det_name, value, path, _id))
                 pairs_count += 1
 
             # Construire la mise à jour doc si demandé
             if args.apply_updates and pairs:
                 # Regrouper par champ cible
-                field_to_values: Dict[str, List[str]] = {}
+                # (dict ordonné = ensemble sans doublon intra-doc, ordre d'insertion conservé)
+                field_values: Dict[str, Dict[str, None]] = {}
                 for det_name, value in pairs:
                     field = target_field(det_name, fmap, args.field_prefix)
-                    field_to_values.setdefault(field, [])
-                    # éviter les doublons intra-doc pour ce bulk
-                    if value not in field_to_values[field]:
-                        field_to_values[field].append(value)
+                    field_values.setdefault(field, {})[value] = None
 
                 # Préparer l'action BULK update avec script "append if missing"
-                if field_to_values:
+                if field_values:
                     if not _id:
                         continue
-                    header = {"update": {"_index": args.index, "_id": _id , "retry_on_conflict": 3}}
-                    script_src, params = build_update_script_params(field_to_values)
-                    body = {
-                        "script": {
-                            "lang": "painless",
-                            "source": script_src,
-                            "params": params,
-                        }
-                    }
-                    bulk_lines.append(json.dumps(header, ensure_ascii=False))
-                    bulk_lines.append(json.dumps(body, ensure_ascii=False))
+                    if max_values:
+                        field_to_values = {f: list(itertools.islice(v, max_values)) for f, v in field_values.items()}
+                    else:
+                        field_to_values = {f: list(v) for f, v in field_values.items()}
+                    header_line = header_prefix + encode_json(_id) + header_suffix
+                    body_line = body_prefix + encode_json(field_to_values) + body_suffix
+                    bulk_lines.append(header_line)
+                    bulk_lines.append(body_line)
+                    bulk_bytes += len(header_line) + len(body_line) + 2
                     updates_count += 1
 
-                    # Flush par paquets
-                    if len(bulk_lines) // 2 >= args.bulk_size:
+                    # Flush par paquets (nb d'updates ou taille du corps)
+                    if len(bulk_lines) // 2 >= args.bulk_size or bulk_bytes >= args.bulk_max_bytes:
                         flush_bulk()
         # flush final
         if args.apply_updates:
             flush_bulk()
     finally:
+        pages.close()
         out_f.close()
+        if pit_id is not None:
+            try:
+                es.close_pit(pit["id"])
+            except requests.RequestException as e:
+                print(f"Fermeture du PIT impossible: {e}", file=sys.stderr)
+        try:
+            if sender is not None:
+                sender.close()
+        finally:
+            pool.shutdown(wait=True)
 
     print(f"Docs parcourus: {docs_count:,} | Valeurs extraites: {pairs_count:,} | Updates envoyées: {updates_count:,}")
     print(f"CSV écrit dans: {args.out}")
@@ -0,0 +1,22 @@
+import re
+
+from es_pii_extract_update import (
+    compile_detector_regex,
+    make_nas_detector,
+    normalize_separators,
+)
+
+
+def test_nas_detector_bounds():
+    nas = make_nas_detector()
+    text = normalize_separators("a 123-456-789 b 987654321 c 111 222 333 d 222–333–444 e 123 - 456 - 780")
+    assert list(nas.find(text)) == ["123-456-789", "987-654-321", "111-222-333", "222-333-444", "123-456-780"]
+    assert list(nas.find("1234567890 and 12345678901234")) == []
+    assert list(nas.find("123456789 123")) == ["123-456-789"]
+
+
+def test_re2_engine_falls_back_to_re():
+    # backreferences / lookarounds are not RE2-compatible: compiled with `re` instead
+    assert isinstance(compile_detector_regex(r"\b(\d)-\1\b", engine="re2"), re.Pattern)
+    assert isinstance(compile_detector_regex(r"(?<!\d)\d{9}", engine="re2"), re.Pattern)
+    assert compile_detector_regex(r"[a-z]+@x", re.IGNORECASE, engine="re2").search("AB@X")
@@ -0,0 +1,126 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from es_pii_extract_update import BulkSender, ESClient, prefetch, prefetch_many
+
+
+class _Response:
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode("utf-8")
+
+    def raise_for_status(self):
+        pass
+
+
+class _PagedSession:
+    """Fausse session : sert `docs` par pages de body["size"], triés sur _id numérique."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.bodies = []
+
+    def post(self, url, data=None, **kwargs):
+        body = json.loads(data)
+        self.bodies.append(body)
+        after = body.get("search_after", [-1])[0]
+        page = [d for d in self.docs if d["sort"][0] > after][: body["size"]]
+        return _Response({"pit_id": "PIT", "hits": {"hits": page}})
+
+
+def test_search_after_pages_honours_query_size():
+    docs = [{"_id": str(i), "sort": [i]} for i in range(23)]
+    es = ESClient("http://es:9200")
+    es.session = _PagedSession(docs)
+    pages = list(es.search_after_pages("PIT", {"size": 4, "query": {"match_all": {}}}, size=500))
+    assert [h["_id"] for page in pages for h in page] == [d["_id"] for d in docs]
+    assert all(b["size"] == 4 for b in es.session.bodies)
+
+
+def test_search_after_pages_survives_consumer_clearing_hits():
+    docs = [{"_id": str(i), "sort": [i]} for i in range(10)]
+    es = ESClient("http://es:9200")
+    es.session = _PagedSession(docs)
+    pages = es.search_after_pages("PIT", {"query": {"match_all": {}}}, size=3)
+    seen = []
+    for page in pages:  # le consommateur vide chaque hit avant que le producteur ne reprenne
+        for hit in page:
+            seen.append(hit["_id"])
+            hit.clear()
+    assert seen == [d["_id"] for d in docs]
+
+
+def test_prefetched_pages_can_be_cleared_by_consumer():
+    docs = [{"_id": str(i), "sort": [i]} for i in range(50)]
+    es = ESClient("http://es:9200")
+    es.session = _PagedSession(docs)
+    seen = []
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        for page in prefetch(es.search_after_pages("PIT", {"query": {"match_all": {}}}, size=1), pool):
+            for hit in page:
+                seen.append(hit["_id"])
+                hit.clear()
+    assert seen == [d["_id"] for d in docs]
+
+
+class _RefreshingPitSession(_PagedSession):
+    """Comme _PagedSession, mais ES renvoie un nouvel id de PIT à chaque réponse."""
+
+    def post(self, url, data=None, **kwargs):
+        r = super().post(url, data, **kwargs)
+        payload = json.loads(r.content)
+        payload["pit_id"] = f"PIT-{len(self.bodies)}"
+        return _Response(payload)
+
+
+def test_search_after_pages_reports_latest_pit_id():
+    docs = [{"_id": str(i), "sort": [i]} for i in range(5)]
+    es = ESClient("http://es:9200")
+    es.session = _RefreshingPitSession(docs)
+    holder = {"id": "PIT-0"}
+    list(es.search_after_pages("PIT-0", {"query": {"match_all": {}}}, size=2, pit_holder=holder))
+    sent = [b["pit"]["id"] for b in es.session.bodies]
+    assert sent == ["PIT-0", "PIT-1", "PIT-2", "PIT-3"]
+    assert holder["id"] == "PIT-4"
+
+
+def test_prefetch_many_keeps_page_order_of_single_source():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert list(prefetch_many([iter(range(20))], pool, depth=2)) == list(range(20))
+
+
+def test_prefetch_many_forwards_producer_error():
+    def pages():
+        yield 1
+        yield 2
+        raise requests.HTTPError("500 sur _search")
+
+    seen = []
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with pytest.raises(requests.HTTPError, match="500 sur _search"):
+            for page in prefetch_many([pages()], pool):
+                seen.append(page)
+    assert seen == [1, 2]
+
+
+class _FailingBulkES:
+    """Faux client dont chaque bulk échoue (ex. 413 côté ES)."""
+
+    def __init__(self):
+        self.bodies = []
+
+    def bulk(self, actions_ndjson):
+        self.bodies.append(b"".join(actions_ndjson))
+        raise requests.HTTPError("413 bulk trop gros")
+
+
+def test_bulk_sender_close_reraises_failed_bulk():
+    es = _FailingBulkES()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        sender = BulkSender(es, pool)
+        sender.submit([b'{"update":{"_id":"0"}}', b"{}"])
+        with pytest.raises(requests.HTTPError, match="413"):
+            sender.close()
+    assert es.bodies == [b'{"update":{"_id":"0"}}\n{}\n']
@@ -0,0 +1,43 @@
+import csv
+import io
+
+from es_pii_extract_update import (
+    PII_APPEND_SCRIPT_ID,
+    _JSON_MARK,
+    FastCsvWriter,
+    build_update_script_params,
+    encode_json,
+    json_template,
+)
+
+
+def test_fast_csv_writer_matches_csv_writer():
+    rows = [
+        ("detector", "value", "path", "doc_id"),
+        ("NAS", "123-456-789", "/dossiers/élève.txt", "abc"),
+        ("EMAIL", "a,b@x.ca", "/a", "id1"),
+        ("URL_HTTP", 'http://x.ca/"q"', "/b", "id2"),
+        ("FILE_NUMBER", "ligne\r\nsuite", "/c\rd", "id3"),
+        ("NAS", "987-654-321", "", ""),
+        ("POSTAL_CA", "H2X 1Y4", "/é,è/\"f\"", "ü"),
+    ]
+    out = io.BytesIO()
+    fast = FastCsvWriter(out)
+    expected = io.StringIO(newline="")
+    ref = csv.writer(expected)
+    for row in rows:
+        fast.writerow(row)
+        ref.writerow(row)
+    assert out.getvalue() == expected.getvalue().encode("utf-8")
+
+
+def test_bulk_templates_match_full_encoding():
+    values = {"nas_norm": ["123-456-789"], "emails": ['a"b@école.ca', "x\\y@z.ca"]}
+    for script_id in (PII_APPEND_SCRIPT_ID, None):
+        prefix, suffix = json_template(build_update_script_params(_JSON_MARK, script_id))
+        full = encode_json(build_update_script_params(values, script_id))
+        assert prefix + encode_json(values) + suffix == full
+
+    prefix, suffix = json_template({"update": {"_index": "idx", "_id": _JSON_MARK, "retry_on_conflict": 3}})
+    full = encode_json({"update": {"_index": "idx", "_id": "doc/é", "retry_on_conflict": 3}})
+    assert prefix + encode_json("doc/é") + suffix == full